@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Frame compression benchmark - CPU time versus bytes on the wire.
+Run:  python bench_compression.py            # default workload
+      python bench_compression.py 5000       # number of frames per run
+"""
+import sys
+import time
+import random
+
+from common import FrameCodec, split_header, HDR
+from server import ChatMessage, MessageType
+
+WORDS = ('hello', 'anyone', 'around', 'deploy', 'server', 'node', 'gossip',
+         'lunch', 'today', 'meeting', 'moved', 'to', 'the', 'at', 'ok', 'thanks')
+
+
+def make_messages(count: int, words: int) -> list:
+    """Build a repeatable batch of chat messages with `words` words each."""
+    rng = random.Random(42)
+    users = [f'user{i}' for i in range(20)]
+    return [
+        ChatMessage(
+            type=MessageType.CHAT,
+            username=rng.choice(users),
+            text=' '.join(rng.choice(WORDS) for _ in range(words)),
+            source_port=9001
+        ).to_dict()
+        for _ in range(count)
+    ]
+
+
+def run(messages: list, threshold: int, persistent: bool, enabled: bool = True,
+        offer: bool = False, peer_accepts: bool = True) -> tuple:
+    """
+    Encode and decode every message; return (wire bytes, seconds).
+
+    Non-persistent runs build a fresh codec pair per frame, like a one-shot
+    connection. The offer key is left out unless `offer` is set, so its
+    bytes are only counted in the row that measures them.
+    """
+    def pair():
+        return (FrameCodec(enabled=enabled, threshold=threshold,
+                           peer_accepts=peer_accepts, offer=offer),
+                FrameCodec(enabled=enabled, threshold=threshold))
+
+    sender, receiver = pair()
+    wire = 0
+    start = time.perf_counter()
+    for obj in messages:
+        if not persistent:
+            sender, receiver = pair()
+        frame = sender.pack(obj)
+        wire += len(frame)
+        length, compressed = split_header(frame[:HDR])
+        receiver.unpack(frame[HDR:HDR + length], compressed)
+    return wire, time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{'payload':<10} {'mode':<22} {'bytes':>10} {'ratio':>7} {'us/frame':>9}")
+    for label, words in (('short', 4), ('medium', 30), ('long', 200)):
+        messages = make_messages(count, words)
+        base_bytes, base_time = run(messages, threshold=0, persistent=True, enabled=False)
+        cases = (
+            ('plain', base_bytes, base_time),
+            # Offer key on every frame, nothing compressed: handshake cost only
+            ('offer only, one-shot', *run(messages, threshold=0, persistent=False,
+                                           offer=True, peer_accepts=False)),
+            ('per-frame, t=0', *run(messages, threshold=0, persistent=False)),
+            ('per-frame, t=256', *run(messages, threshold=256, persistent=False)),
+            ('persistent, t=0', *run(messages, threshold=0, persistent=True, offer=True)),
+            ('persistent, t=256', *run(messages, threshold=256, persistent=True, offer=True)),
+        )
+        for mode, wire, seconds in cases:
+            print(f"{label:<10} {mode:<22} {wire:>10} {wire / base_bytes:>7.2f} "
+                  f"{seconds / count * 1e6:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
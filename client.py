@@ -4,8 +4,8 @@ Usage:  python client.py 9001
         python client.py 9002
 """
 import socket
-import json
 from typing import Dict, List, Tuple, Optional, Any
+from common import FrameCodec, split_header
 # Import from our server module to avoid duplication
 try:
     from server import ChatMessage, MessageType
@@ -17,26 +17,30 @@ except ImportError:
 class TCPChatClient:
     """TCP client for communicating with chat servers."""
 
-    def __init__(self, servers: List[Tuple[str, int]], timeout: float = 2.0):
+    def __init__(self, servers: List[Tuple[str, int]], timeout: float = 2.0,
+                 compression: bool = True):
         self.servers = servers
         self.timeout = timeout
         self.encoding = 'utf-8'
+        self.compression = compression
 
     def send_message(self, message: ChatMessage) -> Optional[Dict[str, Any]]:
         payload = message.to_dict()
-        raw_data = json.dumps(payload).encode(self.encoding)
-        packet = len(raw_data).to_bytes(4, 'big') + raw_data
 
         for host, port in self.servers:
             try:
                 with socket.create_connection((host, port), timeout=self.timeout) as sock:
-                    sock.sendall(packet)
+                    # One request per connection: the server's offer would
+                    # only arrive in the reply, so don't offer and never
+                    # compress; the codec just decodes whatever comes back
+                    codec = FrameCodec(enabled=self.compression, offer=False)
+                    sock.sendall(codec.pack(payload))
 
                     header = sock.recv(4)
                     if not header:
                         continue
 
-                    message_length = int.from_bytes(header, 'big')
+                    message_length, compressed = split_header(header)
                     data = b''
                     while len(data) < message_length:
                         chunk_size = min(4096, message_length - len(data))
@@ -46,7 +50,7 @@ class TCPChatClient:
                         data += chunk
 
                     if len(data) == message_length:
-                        return json.loads(data.decode(self.encoding))
+                        return codec.unpack(data, compressed)
 
             except Exception:
                 continue
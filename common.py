@@ -4,32 +4,130 @@ Tiny shared helpers between client and server.
 import socket
 import json
 import time
+import zlib
 
 ENC = 'utf-8'
 HDR = 4                        # 4-byte header (network order)
 BACKUP_PORT = 9003               # inter-server gossip
 LOG_FILE = 'logs/message_log.txt'
 
+# Frame compression: the top bit of the header marks a deflated payload,
+# the remaining 31 bits carry the payload length on the wire.
+FLAG_COMPRESSED = 0x80000000
+LEN_MASK = 0x7FFFFFFF
+COMPRESS_THRESHOLD = 256         # smaller frames are sent as-is
+COMPRESS_LEVEL = 6
+MAX_FRAME = 16 * 1024 * 1024     # cap on an inflated payload
+OFFER_KEY = 'compress'           # capability key carried in the first frame
+CODEC_NAME = 'deflate'
 
-def send_msg(sock: socket.socket, obj: object) -> None:
+
+class FrameError(Exception):
+    """A frame that cannot be decoded; the connection must be dropped."""
+
+
+class FrameCodec:
+    """
+    Per-connection framing with negotiated deflate compression.
+
+    Each side advertises support by adding ``{"compress": "deflate"}`` to the
+    first frame it sends, and only compresses once it has seen the peer's
+    offer. Compressed frames share one deflate stream per direction, flushed
+    with Z_SYNC_FLUSH, so repeated field names on a long-lived link cost
+    almost nothing after the first few frames.
+
+    Pass ``offer=False`` on one-shot connections: the peer's reply would come
+    too late to use, so the offer would only add bytes.
+    """
+
+    def __init__(self, enabled: bool = True, threshold: int = COMPRESS_THRESHOLD,
+                 level: int = COMPRESS_LEVEL, peer_accepts: bool = False,
+                 offer: bool = True):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.level = level
+        self.peer_accepts = peer_accepts
+        self.offered = not offer
+        self._seen_first = False
+        self._deflate = None
+        self._inflate = None
+
+    def pack(self, obj: dict) -> bytes:
+        """Encode one object as a header-prefixed frame."""
+        if self.enabled and not self.offered:
+            obj = {**obj, OFFER_KEY: CODEC_NAME}
+            self.offered = True
+        raw = json.dumps(obj).encode(ENC)
+        if self.enabled and self.peer_accepts and len(raw) >= self.threshold:
+            if self._deflate is None:
+                self._deflate = zlib.compressobj(
+                    self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            raw = self._deflate.compress(raw) + \
+                self._deflate.flush(zlib.Z_SYNC_FLUSH)
+            return (len(raw) | FLAG_COMPRESSED).to_bytes(HDR, 'big') + raw
+        return len(raw).to_bytes(HDR, 'big') + raw
+
+    def unpack(self, payload: bytes, compressed: bool) -> object:
+        """
+        Decode one frame payload.
+
+        Raises FrameError for a compressed frame that cannot be inflated;
+        the shared inflate stream is then unusable, so callers must close
+        the connection. Malformed JSON still raises ValueError.
+        """
+        if compressed:
+            if not self.enabled:
+                raise FrameError('compressed frame on uncompressed link')
+            if self._inflate is None:
+                self._inflate = zlib.decompressobj(-zlib.MAX_WBITS)
+            try:
+                payload = self._inflate.decompress(payload, MAX_FRAME)
+            except zlib.error as e:
+                raise FrameError(f'bad compressed frame: {e}') from e
+            if self._inflate.unconsumed_tail:
+                raise FrameError('compressed frame exceeds MAX_FRAME')
+        obj = json.loads(payload.decode(ENC))
+        # Only the first frame can carry the offer; later frames are untouched
+        if not self._seen_first:
+            self._seen_first = True
+            if isinstance(obj, dict) and obj.get(OFFER_KEY) == CODEC_NAME:
+                del obj[OFFER_KEY]
+                self.peer_accepts = True
+        return obj
+
+
+def split_header(head: bytes) -> tuple[int, bool]:
+    """Return (payload length, compressed flag) for a frame header."""
+    value = int.from_bytes(head, 'big')
+    return value & LEN_MASK, bool(value & FLAG_COMPRESSED)
+
+
+def send_msg(sock: socket.socket, obj: object, codec: FrameCodec | None = None) -> None:
     """Send length-prefixed JSON."""
+    if codec is not None:
+        sock.sendall(codec.pack(obj))
+        return
     raw = json.dumps(obj).encode(ENC)
     sock.sendall(len(raw).to_bytes(HDR, 'big') + raw)
 
 
-def recv_msg(sock: socket.socket) -> object | None:
+def recv_msg(sock: socket.socket, codec: FrameCodec | None = None) -> object | None:
     """Receive length-prefixed JSON."""
     head = sock.recv(HDR)
     if not head:
         return None
-    n = int.from_bytes(head, 'big')
+    n, compressed = split_header(head)
     data = b''
     while len(data) < n:
         packet = sock.recv(n - len(data))
         if not packet:
             return None
         data += packet
-    return json.loads(data.decode(ENC))
+    if codec is None:
+        if compressed:
+            raise FrameError('compressed frame without a codec')
+        return json.loads(data.decode(ENC))
+    return codec.unpack(data, compressed)
 
 
 def now() -> str:
@@ -15,6 +15,9 @@ from typing import Dict, Set, List, Tuple, Optional, Any
 from dataclasses import dataclass
 from enum import Enum
 
+from common import FrameCodec, FrameError, split_header, COMPRESS_THRESHOLD
+from tracing import Tracer, StackSampler, AnyTrace, NULL_TRACE, PROFILE_SECONDS
+
 
 class MessageType(Enum):
     CHAT = "chat"
@@ -62,19 +65,22 @@ class ChatMessage:
 class ChatClient:
     """Represents a connected chat client."""
 
-    def __init__(self, socket: socket.socket, address: Tuple[str, int], username: str = "anon"):
+    def __init__(self, socket: socket.socket, address: Tuple[str, int], username: str = "anon",
+                 codec: Optional[FrameCodec] = None):
         self.socket = socket
         self.address = address
         self.username = username
+        self.codec = codec or FrameCodec(enabled=False)
         self.connected = True
         self.last_activity = time.time()
+        # Keeps the deflate stream in the same order as bytes on the wire
+        self._send_lock = threading.Lock()
 
     def send(self, message: ChatMessage) -> bool:
         """Send message to client."""
         try:
-            data = json.dumps(message.to_dict()).encode('utf-8')
-            packet = len(data).to_bytes(4, 'big') + data
-            self.socket.sendall(packet)
+            with self._send_lock:
+                self.socket.sendall(self.codec.pack(message.to_dict()))
             self.last_activity = time.time()
             return True
         except (socket.error, ConnectionError, OSError):
@@ -98,9 +104,18 @@ class ChatServer:
     BACKUP_PORT = 9999  # For inter-server communication
     LOG_FILE = 'logs/chat_server.log'
 
-    def __init__(self, port: int = 9001, peers: List[Tuple[str, int]] = None):
+    def __init__(self, port: int = 9001, peers: List[Tuple[str, int]] = None,
+                 compression: bool = True, compress_threshold: int = COMPRESS_THRESHOLD,
+                 peer_compression: bool = False, trace_sample_rate: float = 0.01,
+                 trace_slow_ms: float = 250.0):
         self.port = port
         self.peers = peers or []
+        # Negotiated per connection; only used once the other side offers it
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        # Gossip pushes are one-way, so there is no offer to wait for:
+        # enable only when every peer in the cluster understands the flag bit
+        self.peer_compression = peer_compression
         self.clients: Dict[ChatClient, str] = {}
         self.lock = threading.RLock()
         self.running = False
@@ -113,6 +128,11 @@ class ChatServer:
         # Setup logging
         self._setup_logging()
 
+        # Sampled per-message tracing and on-demand stack profiling
+        self.tracer = Tracer(sample_rate=trace_sample_rate,
+                             slow_ms=trace_slow_ms, logger=self.logger)
+        self.profiler = StackSampler(logger=self.logger)
+
     def _setup_logging(self):
         """Setup logging configuration."""
         os.makedirs('logs', exist_ok=True)
@@ -136,31 +156,42 @@ class ChatServer:
         except IOError as e:
             self.logger.error(f"Failed to write to log file: {e}")
 
-    def broadcast_message(self, message: ChatMessage, exclude_client: Optional[ChatClient] = None):
+    def broadcast_message(self, message: ChatMessage, exclude_client: Optional[ChatClient] = None,
+                          trace: AnyTrace = NULL_TRACE):
         """
         Broadcast message to all connected clients.
 
         Args:
             message: Message to broadcast
             exclude_client: Client to exclude from broadcast (usually sender)
+            trace: Trace recording lock wait and fan-out time
         """
         message.source_port = self.port
 
-        with self.lock:
-            disconnected_clients = []
+        with trace.span('lock'):
+            self.lock.acquire()
+        try:
+            with trace.span('fanout'):
+                self._fan_out(message, exclude_client)
+        finally:
+            self.lock.release()
 
-            for client in list(self.clients.keys()):
-                if client is exclude_client or not client.connected:
-                    if not client.connected:
-                        disconnected_clients.append(client)
-                    continue
+    def _fan_out(self, message: ChatMessage, exclude_client: Optional[ChatClient]):
+        """Send message to every client; caller holds the lock."""
+        disconnected_clients = []
 
-                if not client.send(message):
+        for client in list(self.clients.keys()):
+            if client is exclude_client or not client.connected:
+                if not client.connected:
                     disconnected_clients.append(client)
+                continue
 
-            # Clean up disconnected clients
-            for client in disconnected_clients:
-                self._remove_client(client)
+            if not client.send(message):
+                disconnected_clients.append(client)
+
+        # Clean up disconnected clients
+        for client in disconnected_clients:
+            self._remove_client(client)
 
     def _remove_client(self, client: ChatClient):
         """Remove client and notify others."""
@@ -182,14 +213,15 @@ class ChatServer:
     def handle_client_connection(self, client_socket: socket.socket, client_address: Tuple[str, int]):
         """Handle individual client connection."""
         client = None
+        codec = self._new_codec()
         try:
             # Receive initial join message
-            initial_message = self._receive_message(client_socket)
+            initial_message = self._receive_message(client_socket, codec=codec)
             if not initial_message:
                 return
 
             username = initial_message.username
-            client = ChatClient(client_socket, client_address, username)
+            client = ChatClient(client_socket, client_address, username, codec)
 
             # Add client to connected clients
             with self.lock:
@@ -206,12 +238,15 @@ class ChatServer:
 
             # Handle subsequent messages from client
             while client.connected:
-                message = self._receive_message(client_socket, timeout=1.0)
+                trace = self.tracer.begin()
+                message = self._receive_message(
+                    client_socket, timeout=1.0, codec=codec, trace=trace)
                 if message:
                     if message.type == MessageType.CHAT:
                         # Log and broadcast chat message
                         log_text = f"{username}: {message.text}"
-                        self.log_message(log_text)
+                        with trace.span('log'):
+                            self.log_message(log_text)
 
                         chat_message = ChatMessage(
                             type=MessageType.CHAT,
@@ -219,25 +254,49 @@ class ChatServer:
                             text=message.text
                         )
                         self.broadcast_message(
-                            chat_message, exclude_client=client)
+                            chat_message, exclude_client=client, trace=trace)
 
                         # Gossip to peer servers
-                        self._gossip_to_peers(chat_message)
+                        self._gossip_to_peers(chat_message, trace=trace)
 
                     elif message.type == MessageType.PING:
                         # Respond to ping
                         ping_response = ChatMessage(
                             type=MessageType.PING, text="pong")
-                        client.send(ping_response)
+                        with trace.span('reply'):
+                            client.send(ping_response)
 
+                    trace.finish(message.type.value)
+
+        except FrameError as e:
+            # The link's inflate stream is broken; drop the connection
+            self.logger.warning(
+                f"Dropping {client_address}: undecodable frame: {e}")
+            if not client:
+                client_socket.close()
         except (socket.error, ConnectionError, OSError, json.JSONDecodeError) as e:
             self.logger.warning(f"Client handling error: {e}")
         finally:
             if client:
                 self._remove_client(client)
 
-    def _receive_message(self, sock: socket.socket, timeout: Optional[float] = None) -> Optional[ChatMessage]:
-        """Receive a message from socket."""
+    def _new_codec(self, peer_accepts: bool = False, offer: bool = True) -> FrameCodec:
+        """Create framing state for a new connection."""
+        return FrameCodec(enabled=self.compression or peer_accepts,
+                          threshold=self.compress_threshold,
+                          peer_accepts=peer_accepts, offer=offer)
+
+    def _receive_message(self, sock: socket.socket, timeout: Optional[float] = None,
+                         codec: Optional[FrameCodec] = None,
+                         trace: AnyTrace = NULL_TRACE) -> Optional[ChatMessage]:
+        """
+        Receive a message from socket.
+
+        Returns None on timeout, disconnect or a malformed plain frame.
+        Raises FrameError when a compressed frame cannot be decoded, since
+        the connection's inflate stream cannot recover from that.
+        """
+        codec = codec or self._new_codec()
         try:
             if timeout:
                 sock.settimeout(timeout)
@@ -247,26 +306,28 @@ class ChatServer:
             if not header:
                 return None
 
-            message_length = int.from_bytes(header, 'big')
+            message_length, compressed = split_header(header)
 
-            # Read message data
-            data = b''
-            while len(data) < message_length:
-                chunk = sock.recv(min(4096, message_length - len(data)))
-                if not chunk:
-                    return None
-                data += chunk
+            # Read message data; idle time before the header is not traced
+            with trace.span('receive'):
+                data = b''
+                while len(data) < message_length:
+                    chunk = sock.recv(min(4096, message_length - len(data)))
+                    if not chunk:
+                        return None
+                    data += chunk
 
             # Parse message
-            message_dict = json.loads(data.decode(self.ENCODING))
-            return ChatMessage.from_dict(message_dict)
+            with trace.span('decode'):
+                message_dict = codec.unpack(data, compressed)
+                return ChatMessage.from_dict(message_dict)
 
         except socket.timeout:
             return None
         except (socket.error, ConnectionError, OSError, json.JSONDecodeError, ValueError):
             return None
 
-    def _gossip_to_peers(self, message: ChatMessage):
+    def _gossip_to_peers(self, message: ChatMessage, trace: AnyTrace = NULL_TRACE):
         """Send message to peer servers."""
         if not self.peers:
             return
@@ -282,21 +343,27 @@ class ChatServer:
             try:
                 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as peer_socket:
                     peer_socket.settimeout(2.0)
-                    peer_socket.connect((host, port))
-                    self._send_message(peer_socket, gossip_message)
+                    with trace.span('gossip.connect', f"{host}:{port}"):
+                        peer_socket.connect((host, port))
+                    with trace.span('gossip.send', f"{host}:{port}"):
+                        self._send_message(
+                            peer_socket, gossip_message,
+                            self._new_codec(peer_accepts=self.peer_compression,
+                                            offer=False))
             except (socket.error, ConnectionError, OSError, TimeoutError):
                 self.logger.debug(f"Could not connect to peer {host}:{port}")
 
-    def _send_message(self, sock: socket.socket, message: ChatMessage):
+    def _send_message(self, sock: socket.socket, message: ChatMessage,
+                      codec: Optional[FrameCodec] = None):
         """Send message to socket."""
-        data = json.dumps(message.to_dict()).encode(self.ENCODING)
-        packet = len(data).to_bytes(4, 'big') + data
-        sock.sendall(packet)
+        codec = codec or self._new_codec(offer=False)
+        sock.sendall(codec.pack(message.to_dict()))
 
     def handle_peer_connection(self, peer_socket: socket.socket, peer_address: Tuple[str, int]):
         """Handle incoming connection from peer server."""
         try:
-            message = self._receive_message(peer_socket)
+            trace = self.tracer.begin()
+            message = self._receive_message(peer_socket, trace=trace)
             if message and message.type == MessageType.GOSSIP:
                 # Re-broadcast gossip message to clients
                 chat_message = ChatMessage(
@@ -304,9 +371,14 @@ class ChatServer:
                     username=message.username,
                     text=message.text
                 )
-                self.broadcast_message(chat_message)
-                self.log_message(f"{message.username}: {message.text}")
-
+                self.broadcast_message(chat_message, trace=trace)
+                with trace.span('log'):
+                    self.log_message(f"{message.username}: {message.text}")
+                trace.finish('peer-gossip')
+
+        except FrameError as e:
+            self.logger.warning(
+                f"Dropping peer {peer_address}: undecodable frame: {e}")
         except (socket.error, ConnectionError, OSError, json.JSONDecodeError) as e:
             self.logger.debug(f"Peer connection error: {e}")
         finally:
@@ -402,6 +474,13 @@ class ChatServer:
 
         self.logger.info("Chat server stopped")
 
+    def start_profile(self, seconds: float = PROFILE_SECONDS) -> bool:
+        """Sample all thread stacks for `seconds`; False if already running."""
+        started = self.profiler.start(seconds)
+        if not started:
+            self.logger.info("Profiler already running")
+        return started
+
 
 def main():
     """Main entry point."""
@@ -409,11 +488,27 @@ def main():
         print("Usage: python server.py <port> [peer_port1] [peer_port2] ...")
         sys.exit(1)
 
+    # Tracing settings are parsed apart from the ports so a bad value
+    # gets its own error message
+    try:
+        trace_sample_rate = float(os.environ.get('CHAT_TRACE_SAMPLE', '0.01'))
+        trace_slow_ms = float(os.environ.get('CHAT_TRACE_SLOW_MS', '250'))
+    except ValueError:
+        print("Error: CHAT_TRACE_SAMPLE and CHAT_TRACE_SLOW_MS must be numbers")
+        sys.exit(1)
+    if not 0.0 <= trace_sample_rate <= 1.0:
+        print("Error: CHAT_TRACE_SAMPLE must be between 0 and 1")
+        sys.exit(1)
+
     try:
         port = int(sys.argv[1])
         peers = [('localhost', int(p)) for p in sys.argv[2:]]
 
-        server = ChatServer(port=port, peers=peers)
+        server = ChatServer(
+            port=port, peers=peers,
+            peer_compression=os.environ.get('CHAT_PEER_COMPRESSION') == '1',
+            trace_sample_rate=trace_sample_rate,
+            trace_slow_ms=trace_slow_ms)
 
         # Handle graceful shutdown
         def signal_handler(signum, frame):
@@ -426,6 +521,16 @@ def main():
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
 
+        # On-demand diagnostics: SIGUSR1 profiles, SIGUSR2 dumps traces.
+        # Both hand off to a thread so nothing logs in signal context.
+        def run_in_thread(target):
+            return lambda signum, frame: threading.Thread(
+                target=target, daemon=True).start()
+
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, run_in_thread(server.start_profile))
+            signal.signal(signal.SIGUSR2, run_in_thread(server.tracer.dump))
+
         server.start()
 
     except ValueError:
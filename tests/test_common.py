@@ -0,0 +1,154 @@
+"""Tests for the length-prefixed framing and negotiated compression."""
+import json
+import socket
+
+import pytest
+
+import common
+from common import (FrameCodec, FrameError, split_header, send_msg, recv_msg,
+                    FLAG_COMPRESSED, HDR, OFFER_KEY)
+
+SMALL = {'type': 'chat', 'username': 'alice', 'text': 'hi'}
+LARGE = {'type': 'chat', 'username': 'alice', 'text': 'hello there ' * 100}
+
+
+@pytest.fixture
+def pair():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+def negotiated(threshold: int = 64):
+    """Return two codecs that have already exchanged offers."""
+    a, b = FrameCodec(threshold=threshold), FrameCodec(threshold=threshold)
+    for sender, receiver in ((a, b), (b, a)):
+        frame = sender.pack({})
+        receiver.unpack(frame[HDR:], False)
+    return a, b
+
+
+def test_split_header():
+    assert split_header((5).to_bytes(HDR, 'big')) == (5, False)
+    assert split_header((5 | FLAG_COMPRESSED).to_bytes(HDR, 'big')) == (5, True)
+
+
+def test_round_trip_below_threshold_is_plain():
+    a, b = negotiated(threshold=1000)
+    frame = a.pack(SMALL)
+    length, compressed = split_header(frame[:HDR])
+    assert not compressed
+    assert json.loads(frame[HDR:]) == SMALL
+    assert b.unpack(frame[HDR:HDR + length], compressed) == SMALL
+
+
+def test_round_trip_above_threshold_shares_stream():
+    a, b = negotiated()
+    sizes = []
+    for _ in range(3):
+        frame = a.pack(LARGE)
+        length, compressed = split_header(frame[:HDR])
+        assert compressed
+        assert b.unpack(frame[HDR:HDR + length], compressed) == LARGE
+        sizes.append(length)
+    # Later frames reuse the window, so repeats cost less than the first
+    assert sizes[1] < sizes[0]
+
+
+def test_negotiation_in_both_directions():
+    a, b = FrameCodec(threshold=64), FrameCodec(threshold=64)
+
+    # a's first frame carries the offer but cannot be compressed yet
+    frame = a.pack(LARGE)
+    assert not split_header(frame[:HDR])[1]
+    assert b.unpack(frame[HDR:], False) == LARGE
+    assert b.peer_accepts and not a.peer_accepts
+
+    # b may compress straight away, and its offer reaches a in the same frame
+    frame = b.pack(LARGE)
+    length, compressed = split_header(frame[:HDR])
+    assert compressed
+    assert a.unpack(frame[HDR:HDR + length], compressed) == LARGE
+    assert a.peer_accepts
+
+    frame = a.pack(LARGE)
+    assert split_header(frame[:HDR])[1]
+
+
+def test_offer_sent_once_and_not_on_one_shot():
+    codec = FrameCodec()
+    assert json.loads(codec.pack(SMALL)[HDR:])[OFFER_KEY] == 'deflate'
+    assert OFFER_KEY not in json.loads(codec.pack(SMALL)[HDR:])
+    assert OFFER_KEY not in json.loads(FrameCodec(offer=False).pack(SMALL)[HDR:])
+
+
+def test_legacy_peer_without_codec(pair):
+    a, b = pair
+    codec = FrameCodec(threshold=64)
+
+    # Legacy sender: no offer, so the codec side never compresses
+    send_msg(a, LARGE)
+    assert recv_msg(b, codec) == LARGE
+    assert not codec.peer_accepts
+
+    # Legacy receiver sees the offer as an ignorable extra key
+    send_msg(b, LARGE, codec)
+    received = recv_msg(a)
+    assert received.pop(OFFER_KEY) == 'deflate'
+    assert received == LARGE
+    send_msg(b, LARGE, codec)
+    assert recv_msg(a) == LARGE
+
+
+def test_compressed_frame_without_codec_is_rejected(pair):
+    a, b = pair
+    sender, _ = negotiated()
+    a.sendall(sender.pack(LARGE))
+    with pytest.raises(FrameError):
+        recv_msg(b)
+
+
+def test_compressed_frame_on_disabled_codec_is_rejected():
+    sender, _ = negotiated()
+    frame = sender.pack(LARGE)
+    with pytest.raises(FrameError):
+        FrameCodec(enabled=False).unpack(frame[HDR:], True)
+
+
+def test_max_frame_cap(monkeypatch):
+    monkeypatch.setattr(common, 'MAX_FRAME', 512)
+    a, b = negotiated()
+    frame = a.pack({'text': 'x' * 4096})
+    with pytest.raises(FrameError):
+        b.unpack(frame[HDR:], True)
+
+
+def test_corrupt_compressed_frame(pair):
+    a, b = pair
+    garbage = b'\xff' * 32
+    a.sendall((len(garbage) | FLAG_COMPRESSED).to_bytes(HDR, 'big') + garbage)
+    with pytest.raises(FrameError):
+        recv_msg(b, FrameCodec())
+
+
+def test_offer_only_read_from_first_frame():
+    a, b = FrameCodec(offer=False), FrameCodec()
+
+    # A first frame without the offer ends the handshake
+    b.unpack(a.pack(SMALL)[HDR:], False)
+    late = {**SMALL, OFFER_KEY: 'deflate'}
+    assert b.unpack(a.pack(late)[HDR:], False) == late
+    assert not b.peer_accepts
+
+
+def test_payload_compress_field_is_preserved():
+    a, b = FrameCodec(), FrameCodec()
+    b.unpack(a.pack(SMALL)[HDR:], False)
+    obj = {**SMALL, OFFER_KEY: 'lz4'}
+    assert b.unpack(a.pack(obj)[HDR:], False) == obj
+
+    # A non-deflate value in the first frame is payload, not an offer
+    c = FrameCodec()
+    assert c.unpack(json.dumps(obj).encode(), False) == obj
+    assert not c.peer_accepts
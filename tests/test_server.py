@@ -0,0 +1,26 @@
+"""Tests for ChatServer connection handling."""
+import socket
+import threading
+
+from common import FrameCodec, FLAG_COMPRESSED, HDR, send_msg
+from server import ChatServer, ChatMessage, MessageType
+
+
+def test_bad_compressed_frame_drops_client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = ChatServer(port=9401)
+    ours, theirs = socket.socketpair()
+    handler = threading.Thread(
+        target=server.handle_client_connection,
+        args=(theirs, ('127.0.0.1', 50000)), daemon=True)
+    handler.start()
+
+    send_msg(ours, ChatMessage(type=MessageType.JOIN, username='alice').to_dict(),
+             FrameCodec())
+    garbage = b'\xff' * 32
+    ours.sendall((len(garbage) | FLAG_COMPRESSED).to_bytes(HDR, 'big') + garbage)
+
+    handler.join(timeout=5)
+    assert not handler.is_alive()
+    assert not server.clients
+    ours.close()
@@ -0,0 +1,135 @@
+"""Tests for sampled message tracing and the stack sampler."""
+import logging
+import socket
+import time
+
+import pytest
+
+from common import FrameCodec
+from server import ChatServer, ChatMessage, MessageType
+from tracing import Tracer, Trace, StackSampler, NULL_TRACE
+
+
+def make_trace(tracer: Tracer, duration_ms: float, label: str = 'chat') -> Trace:
+    """Build a finished-looking trace without sleeping."""
+    trace = Trace(tracer)
+    trace.start = 0.0
+    trace.label = label
+    trace.duration = duration_ms / 1000
+    return trace
+
+
+def test_sample_rate_bounds():
+    never, always = Tracer(sample_rate=0.0), Tracer(sample_rate=1.0)
+    assert all(never.begin() is NULL_TRACE for _ in range(200))
+    assert all(isinstance(always.begin(), Trace) for _ in range(200))
+
+
+@pytest.mark.parametrize('rate', [-0.1, 1.5])
+def test_sample_rate_out_of_range(rate):
+    with pytest.raises(ValueError):
+        Tracer(sample_rate=rate)
+
+
+def test_null_trace_is_a_no_op():
+    with NULL_TRACE.span('receive'):
+        pass
+    NULL_TRACE.finish('chat')
+
+
+def test_finish_without_spans_records_nothing():
+    tracer = Tracer(sample_rate=1.0)
+    tracer.begin().finish('chat')
+    assert not tracer.ring
+
+
+def test_finish_records_spans():
+    tracer = Tracer(sample_rate=1.0)
+    trace = tracer.begin()
+    with trace.span('receive'):
+        pass
+    with trace.span('gossip.connect', 'localhost:9002'):
+        pass
+    trace.finish('chat')
+    assert list(tracer.ring) == [trace]
+    assert trace.label == 'chat'
+    assert [name for name, _, _ in trace.spans] == [
+        'receive', 'gossip.connect localhost:9002']
+
+
+def test_ring_keeps_newest():
+    tracer = Tracer(ring_size=3, slow_ms=1e9)
+    traces = [make_trace(tracer, 1.0, f"t{i}") for i in range(5)]
+    for trace in traces:
+        tracer.record(trace)
+    assert list(tracer.ring) == traces[-3:]
+
+
+def test_slow_trace_warning_threshold(caplog):
+    logger = logging.getLogger('test-tracer')
+    tracer = Tracer(slow_ms=50.0, logger=logger)
+    with caplog.at_level(logging.WARNING, logger='test-tracer'):
+        tracer.record(make_trace(tracer, 49.0, 'fast'))
+        tracer.record(make_trace(tracer, 50.0, 'edge'))
+        tracer.record(make_trace(tracer, 80.0, 'slow'))
+    warnings = [r.getMessage() for r in caplog.records if r.levelno == logging.WARNING]
+    assert len(warnings) == 2
+    assert warnings[0].startswith('Slow trace: edge')
+    assert warnings[1].startswith('Slow trace: slow')
+
+
+def test_dump_logs_buffered_traces(caplog):
+    logger = logging.getLogger('test-dump')
+    tracer = Tracer(slow_ms=1e9, logger=logger)
+    tracer.record(make_trace(tracer, 1.0, 'chat'))
+    with caplog.at_level(logging.INFO, logger='test-dump'):
+        tracer.dump()
+    messages = [r.getMessage() for r in caplog.records]
+    assert messages[0] == 'Dumping 1 buffered traces'
+    assert messages[1].startswith('chat 1.0ms')
+
+
+def test_stack_sampler_single_run_writes_folded(tmp_path):
+    sampler = StackSampler(interval=0.005, out_dir=str(tmp_path))
+    assert sampler.start(0.2)
+    assert not sampler.start(0.2)
+
+    deadline = time.monotonic() + 5
+    while sampler._running.locked() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert not sampler._running.locked()
+
+    files = list(tmp_path.glob('profile-*.folded'))
+    assert len(files) == 1
+    lines = files[0].read_text(encoding='utf-8').splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert 'test_stack_sampler_single_run_writes_folded' in stack
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return ChatServer(port=9402, trace_sample_rate=1.0, trace_slow_ms=1e9)
+
+
+def test_broadcast_records_lock_and_fanout(server):
+    trace = server.tracer.begin()
+    server.broadcast_message(
+        ChatMessage(type=MessageType.SYSTEM, text='hello'), trace=trace)
+    assert [name for name, _, _ in trace.spans] == ['lock', 'fanout']
+
+
+def test_receive_records_receive_and_decode(server):
+    ours, theirs = socket.socketpair()
+    try:
+        ours.sendall(FrameCodec(offer=False).pack(
+            ChatMessage(type=MessageType.CHAT, text='hi').to_dict()))
+        trace = server.tracer.begin()
+        message = server._receive_message(theirs, trace=trace)
+    finally:
+        ours.close()
+        theirs.close()
+    assert message.text == 'hi'
+    assert [name for name, _, _ in trace.spans] == ['receive', 'decode']
@@ -0,0 +1,200 @@
+"""
+Sampled per-message tracing and an on-demand stack sampler for the chat server.
+
+A trace is a flat list of timed spans (receive, decode, log, lock, fanout,
+gossip, ...) for one message. Only a sampled fraction of messages is traced;
+unsampled messages get NULL_TRACE, whose spans are shared no-op objects.
+"""
+import collections
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Union
+
+TRACE_RING_SIZE = 256
+PROFILE_INTERVAL = 0.01          # seconds between stack samples
+PROFILE_SECONDS = 10.0
+
+
+class _Span:
+    """Context manager that records one span on enter/exit."""
+
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace: 'Trace', name: str):
+        self.trace = trace
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        if self.trace.start is None:
+            self.trace.start = self.start
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.spans.append(
+            (self.name, self.start, time.perf_counter() - self.start))
+        return False
+
+
+class Trace:
+    """Spans recorded for one sampled message."""
+
+    __slots__ = ('tracer', 'label', 'start', 'duration', 'spans')
+
+    def __init__(self, tracer: 'Tracer'):
+        self.tracer = tracer
+        self.label = ''
+        self.start: Optional[float] = None
+        self.duration = 0.0
+        self.spans: List[tuple] = []
+
+    def span(self, name: str, detail: str = '') -> _Span:
+        return _Span(self, f"{name} {detail}" if detail else name)
+
+    def finish(self, label: str = ''):
+        """Close the trace and hand it to the tracer (no-op if nothing ran)."""
+        if self.start is None:
+            return
+        self.label = label
+        self.duration = time.perf_counter() - self.start
+        self.tracer.record(self)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _NullTrace:
+    """Stand-in for unsampled messages; every call is a no-op."""
+
+    __slots__ = ()
+    _span = _NullSpan()
+
+    def span(self, name: str, detail: str = '') -> _NullSpan:
+        return self._span
+
+    def finish(self, label: str = ''):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+# What Tracer.begin() hands out: a real trace or the shared no-op one
+AnyTrace = Union[Trace, _NullTrace]
+
+
+class Tracer:
+    """Samples message traces into a ring buffer and logs slow ones."""
+
+    def __init__(self, sample_rate: float = 0.01, slow_ms: float = 250.0,
+                 ring_size: int = TRACE_RING_SIZE, logger: Optional[logging.Logger] = None):
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError(f"sample_rate must be between 0 and 1, got {sample_rate}")
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.ring: collections.deque = collections.deque(maxlen=ring_size)
+        self.logger = logger or logging.getLogger('Tracer')
+
+    def begin(self) -> AnyTrace:
+        """Start a trace for the next message, or NULL_TRACE if not sampled."""
+        if random.random() >= self.sample_rate:
+            return NULL_TRACE
+        return Trace(self)
+
+    def record(self, trace: Trace):
+        self.ring.append(trace)
+        if trace.duration * 1000 >= self.slow_ms:
+            self.logger.warning(f"Slow trace: {self.format(trace)}")
+
+    def dump(self):
+        """Log every buffered trace."""
+        traces = list(self.ring)
+        self.logger.info(f"Dumping {len(traces)} buffered traces")
+        for trace in traces:
+            self.logger.info(self.format(trace))
+
+    @staticmethod
+    def format(trace: Trace) -> str:
+        spans = ', '.join(
+            f"{name}=+{(start - trace.start) * 1000:.1f}/{duration * 1000:.1f}ms"
+            for name, start, duration in trace.spans
+        )
+        return f"{trace.label} {trace.duration * 1000:.1f}ms [{spans}]"
+
+
+class StackSampler:
+    """On-demand sampling profiler over every thread's Python stack."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, out_dir: str = 'logs',
+                 logger: Optional[logging.Logger] = None):
+        self.interval = interval
+        self.out_dir = out_dir
+        self.logger = logger or logging.getLogger('StackSampler')
+        self._running = threading.Lock()
+
+    def start(self, seconds: float = PROFILE_SECONDS) -> bool:
+        """Profile in a background thread; False if a run is in progress."""
+        if not self._running.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._run, args=(seconds,), daemon=True).start()
+        return True
+
+    def _run(self, seconds: float):
+        try:
+            counts = self.sample(seconds)
+            path = self._write(counts)
+            total = sum(counts.values())
+            self.logger.info(
+                f"Profile: {total} samples over {seconds:.1f}s written to {path}")
+            for stack, count in counts.most_common(5):
+                self.logger.info(f"  {count:6d}  {stack.rsplit(';', 1)[-1]}")
+        except Exception as e:
+            self.logger.error(f"Profiler error: {e}")
+        finally:
+            self._running.release()
+
+    def sample(self, seconds: float) -> collections.Counter:
+        """Collect folded stacks ("outer;...;inner" -> samples) for `seconds`."""
+        counts: collections.Counter = collections.Counter()
+        # Frame labels repeat across samples; build each one only once
+        labels: Dict[tuple, str] = {}
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    key = (code, frame.f_lineno)
+                    label = labels.get(key)
+                    if label is None:
+                        filename = os.path.basename(code.co_filename)
+                        label = labels[key] = f"{code.co_name} ({filename}:{frame.f_lineno})"
+                    stack.append(label)
+                    frame = frame.f_back
+                counts[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+        return counts
+
+    def _write(self, counts: collections.Counter) -> str:
+        """Write stacks in the folded format flamegraph tools read."""
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(
+            self.out_dir, f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        return path